@@ -5,6 +5,10 @@ This module provides a QGIS processing algorithm for enriching vehicle location
 data with GTFS route information from the Open Bus Stride API.
 """
 
+import threading
+import time
+from collections import OrderedDict
+
 from qgis.PyQt.QtCore import QCoreApplication, QVariant
 from qgis.core import (
     QgsProcessingAlgorithm,
@@ -15,8 +19,8 @@ from qgis.core import (
     QgsProcessingException,
     QgsFields,
     QgsField,
-    QgsFeature,
     QgsFeatureSink,
+    QgsFeatureRequest,
     QgsWkbTypes,
     NULL
 )
@@ -37,6 +41,9 @@ class EnrichWithRoutes(QgsProcessingAlgorithm):
     LINE_REF_FIELD = 'LINE_REF_FIELD'
     OUTPUT = 'OUTPUT'
     
+    # Number of features written to the sink per addFeatures call
+    SINK_BATCH_SIZE = 5000
+    
     # Additional fields from GTFS routes API
     ROUTE_FIELDS = [
         # ('id', QVariant.Int),
@@ -57,7 +64,20 @@ class EnrichWithRoutes(QgsProcessingAlgorithm):
     GTFS_FIELD_MAP = {
         'siri_line_ref': 'line_ref',
         'siri_operator_ref': 'operator_ref',
+        # Calculated once per line in _fetch_route_data
+        'route_desc': '_route_desc',
     }
+    
+    # Maximum number of line_refs per /gtfs_routes/list request
+    LINE_REFS_BATCH_SIZE = 200
+    
+    # Session-wide cache of GTFS route responses, shared by all instances
+    # and runs (guarded by _route_cache_lock). Entries expire after
+    # ROUTE_CACHE_TTL seconds
+    ROUTE_CACHE_SIZE = 128
+    ROUTE_CACHE_TTL = 24 * 60 * 60
+    _route_cache = OrderedDict()
+    _route_cache_lock = threading.Lock()
 
     def tr(self, string):
         """Translate strings for internationalization."""
@@ -143,7 +163,8 @@ class EnrichWithRoutes(QgsProcessingAlgorithm):
         feedback.pushInfo(self.tr('Step 1/3: Extracting unique line references and date range...'))
         feedback.setProgress(0)
         
-        unique_line_refs, date_from, date_to = self._extract_unique_line_refs_and_dates(
+        (unique_line_refs, date_from, date_to,
+         feature_count) = self._extract_unique_line_refs_and_dates(
             input_layer, line_ref_field, feedback
         )
         
@@ -174,7 +195,8 @@ class EnrichWithRoutes(QgsProcessingAlgorithm):
         
         sink = self._create_output_sink(parameters, context, input_layer)
         self._enrich_features(
-            input_layer, line_ref_field, route_data_map, sink, feedback
+            input_layer, line_ref_field, route_data_map, sink,
+            feature_count, feedback
         )
         
         feedback.setProgress(100)
@@ -192,26 +214,45 @@ class EnrichWithRoutes(QgsProcessingAlgorithm):
             feedback: Processing feedback object
             
         Returns:
-            tuple: (set of unique line_refs, date_from str, date_to str)
+            tuple: (set of unique line_refs, date_from str, date_to str,
+                number of features scanned)
         """
         from qgis.PyQt.QtCore import QDateTime, Qt
         
-        field_index = layer.fields().indexFromName(field_name)
+        fields = layer.fields()
+        field_index = fields.indexFromName(field_name)
         if field_index == -1:
             raise QgsProcessingException(
                 self.tr(f'Field "{field_name}" not found in input layer')
             )
         
+        # Resolve available date fields once (tried in order per feature)
+        date_fields = ['recorded_at', 'begin', 'end', 'scheduled_start']
+        date_indexes = [
+            fields.indexFromName(date_field) for date_field in date_fields
+            if fields.indexFromName(date_field) != -1
+        ]
+        
+        # Only fetch the attributes we read, without geometry
+        request = QgsFeatureRequest()
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes([field_index] + date_indexes)
+        
         unique_refs = set()
-        min_date = None
-        max_date = None
+        # Running bounds compared as plain integers, with matching QDateTimes
+        min_msecs = max_msecs = None
+        min_date = max_date = None
+        feature_count = 0
         
-        for feature in layer.getFeatures():
+        for feature in layer.getFeatures(request):
             if feedback.isCanceled():
                 break
             
+            feature_count += 1
+            attributes = feature.attributes()
+            
             # Extract line_ref
-            value = feature[field_name]
+            value = attributes[field_index]
             if value is not None and value != NULL:
                 try:
                     unique_refs.add(int(value))
@@ -221,22 +262,20 @@ class EnrichWithRoutes(QgsProcessingAlgorithm):
                     )
             
             # Extract date from available date fields (try in order)
-            date_fields = ['recorded_at', 'begin', 'end', 'scheduled_start']
-            for date_field in date_fields:
-                # Check if field exists in the layer
-                if layer.fields().indexFromName(date_field) == -1:
-                    continue
-                    
-                date_value = feature.attribute(date_field)
+            for date_index in date_indexes:
+                date_value = attributes[date_index]
                 if date_value is not None and isinstance(date_value, QDateTime):
-                    if min_date is None or date_value < min_date:
+                    msecs = date_value.toMSecsSinceEpoch()
+                    if min_msecs is None or msecs < min_msecs:
+                        min_msecs = msecs
                         min_date = date_value
-                    if max_date is None or date_value > max_date:
+                    if max_msecs is None or msecs > max_msecs:
+                        max_msecs = msecs
                         max_date = date_value
                     break  # Found a valid date field, stop trying others
         
         # Format dates as YYYY-MM-DD
-        if min_date and max_date:
+        if min_date is not None:
             date_from = min_date.toString('yyyy-MM-dd')
             date_to = max_date.toString('yyyy-MM-dd')
         else:
@@ -249,11 +288,14 @@ class EnrichWithRoutes(QgsProcessingAlgorithm):
                 self.tr('No valid dates found in data, using today\'s date')
             )
         
-        return unique_refs, date_from, date_to
+        return unique_refs, date_from, date_to, feature_count
     
     def _fetch_route_data(self, line_refs, date_from, date_to, feedback):
         """
-        Fetch GTFS route data for all line references in a single request.
+        Fetch GTFS route data for all line references.
+        
+        Line references are queried in batches of LINE_REFS_BATCH_SIZE,
+        and batches missing from the route cache are requested concurrently.
         
         Args:
             line_refs (set): Set of line_ref values to query
@@ -267,24 +309,33 @@ class EnrichWithRoutes(QgsProcessingAlgorithm):
         api_client = StrideAPIClient(feedback)
         route_data_map = {}
         
-        # Convert line_refs to comma-separated string
-        line_refs_str = ','.join(str(ref) for ref in sorted(line_refs))
+        # Split line_refs into batches to keep request URLs short
+        sorted_refs = sorted(line_refs)
+        batch_size = self.LINE_REFS_BATCH_SIZE
+        batches = [
+            sorted_refs[i:i + batch_size]
+            for i in range(0, len(sorted_refs), batch_size)
+        ]
         
         feedback.pushInfo(
-            self.tr(f'Fetching route data for {len(line_refs)} line reference(s)...')
+            self.tr(f'Fetching route data for {len(line_refs)} line reference(s) '
+                    f'in {len(batches)} request(s)...')
         )
         
-        # Build query parameters with all line_refs
-        params = {
-            'get_count': 'false',
-            'date_from': date_from,
-            'date_to': date_to,
-            'line_refs': line_refs_str,
-            'order_by': 'id asc'
-        }
+        # Build query parameters for each batch of line_refs
+        params_list = [
+            {
+                'get_count': 'false',
+                'date_from': date_from,
+                'date_to': date_to,
+                'line_refs': ','.join(str(ref) for ref in batch),
+                'order_by': 'id asc'
+            }
+            for batch in batches
+        ]
         
         try:
-            data = api_client.fetch_data('/gtfs_routes/list', params)
+            data = self._fetch_routes_cached(api_client, params_list, feedback)
             
             if data and len(data) > 0:
                 feedback.pushInfo(
@@ -297,6 +348,13 @@ class EnrichWithRoutes(QgsProcessingAlgorithm):
                     if line_ref is not None:
                         # Store first occurrence for each line_ref
                         if line_ref not in route_data_map:
+                            # Compose route_desc once per line instead of per feature
+                            route_mkt = route.get('route_mkt', '')
+                            route_direction = route.get('route_direction', '')
+                            route_alternative = route.get('route_alternative', '')
+                            route['_route_desc'] = (
+                                f"{route_mkt}-{route_direction}-{route_alternative}"
+                            )
                             route_data_map[line_ref] = route
                             feedback.pushInfo(
                                 self.tr(f'  Line {line_ref}: {route.get("route_long_name", "N/A")}')
@@ -327,6 +385,69 @@ class EnrichWithRoutes(QgsProcessingAlgorithm):
         
         return route_data_map
     
+    def _fetch_routes_cached(self, api_client, params_list, feedback):
+        """
+        Fetch GTFS routes, reusing responses from earlier runs in the session.
+        
+        GTFS route data for a given date range rarely changes, so responses
+        are kept in a class-level LRU cache keyed by the query parameters,
+        for up to ROUTE_CACHE_TTL seconds. Only responses with routes are
+        cached, so an empty or invalid reply is requested again next time.
+        Queries missing from the cache are requested concurrently.
+        
+        Args:
+            api_client (StrideAPIClient): Client used on a cache miss
+            params_list (list): Query parameters for each /gtfs_routes/list request
+            feedback: Processing feedback object
+            
+        Returns:
+            list: Route records from all requests, in request order
+        """
+        cache = EnrichWithRoutes._route_cache
+        lock = EnrichWithRoutes._route_cache_lock
+        cache_keys = [tuple(sorted(params.items())) for params in params_list]
+        
+        # Runs in background tasks can share the cache concurrently
+        cached = {}
+        with lock:
+            now = time.monotonic()
+            for key in [key for key, (stored_at, _) in cache.items()
+                        if now - stored_at > self.ROUTE_CACHE_TTL]:
+                del cache[key]
+            for key in cache_keys:
+                if key in cache:
+                    cache.move_to_end(key)
+                    cached[key] = cache[key][1]
+        
+        missing = [
+            (key, params) for key, params in zip(cache_keys, params_list)
+            if key not in cached
+        ]
+        if cached:
+            feedback.pushInfo(
+                self.tr(f'Using cached route data for '
+                        f'{len(params_list) - len(missing)} request(s)')
+            )
+        
+        fetched = {}
+        if missing:
+            results = api_client.fetch_many(
+                [('/gtfs_routes/list', params) for _, params in missing]
+            )
+            fetched = dict(zip((key for key, _ in missing), results))
+            with lock:
+                for key, routes in fetched.items():
+                    if routes:
+                        cache[key] = (time.monotonic(), routes)
+                        cache.move_to_end(key)
+                while len(cache) > self.ROUTE_CACHE_SIZE:
+                    cache.popitem(last=False)
+        
+        data = []
+        for key in cache_keys:
+            data.extend(cached[key] if key in cached else fetched[key])
+        return data
+    
     def _create_output_sink(self, parameters, context, input_layer):
         """
         Create the output feature sink with enriched fields.
@@ -337,14 +458,21 @@ class EnrichWithRoutes(QgsProcessingAlgorithm):
             input_layer: Input vector layer
             
         Returns:
-            tuple: (sink, dest_id)
+            tuple: (sink, dest_id, output_fields, route_plan) where route_plan
+                lists (output_index, api_key) for each added route field
         """
         # Create output fields (original + route fields)
         output_fields = QgsFields(input_layer.fields())
         
+        # Resolve where and from which API key each new field is filled
+        route_plan = []
         for field_name, field_type in self.ROUTE_FIELDS:
             if output_fields.indexFromName(field_name) == -1:
                 output_fields.append(QgsField(field_name, field_type))
+                route_plan.append((
+                    output_fields.count() - 1,
+                    self.GTFS_FIELD_MAP.get(field_name, field_name)
+                ))
         
         # Create sink
         (sink, dest_id) = self.parameterAsSink(
@@ -355,10 +483,10 @@ class EnrichWithRoutes(QgsProcessingAlgorithm):
         if sink is None:
             raise QgsProcessingException(self.tr('Invalid output specified.'))
         
-        return (sink, dest_id)
+        return (sink, dest_id, output_fields, route_plan)
     
     def _enrich_features(self, input_layer, line_ref_field, route_data_map, 
-                         sink_info, feedback):
+                         sink_info, total, feedback):
         """
         Create enriched features with route data joined.
         
@@ -366,32 +494,22 @@ class EnrichWithRoutes(QgsProcessingAlgorithm):
             input_layer: Input vector layer
             line_ref_field (str): Name of the line_ref field
             route_data_map (dict): Map of line_ref -> route data
-            sink_info (tuple): (sink, dest_id)
+            sink_info (tuple): (sink, dest_id, output_fields, route_plan)
+            total (int): Number of input features, used for progress
             feedback: Processing feedback object
         """
-        sink = sink_info[0]
+        sink, _, output_fields, route_plan = sink_info
         
-        # Get output field structure
-        output_fields = QgsFields(input_layer.fields())
+        route_padding = [NULL] * len(route_plan)
         
-        # Track which fields are actually new (not duplicates)
-        new_route_fields = []
-        for field_name, field_type in self.ROUTE_FIELDS:
-            if output_fields.indexFromName(field_name) == -1:
-                output_fields.append(QgsField(field_name, field_type))
-                new_route_fields.append(field_name)
-        
-        total = input_layer.featureCount()
+        last_progress = -1
+        batch = []
         for i, in_feature in enumerate(input_layer.getFeatures()):
             if feedback.isCanceled():
                 break
             
-            # Create output feature
-            out_feature = QgsFeature(output_fields)
-            out_feature.setGeometry(in_feature.geometry())
-            
-            # Copy original attributes
-            attributes = list(in_feature.attributes())
+            # Copy original attributes, with NULL placeholders for route fields
+            attributes = in_feature.attributes() + route_padding
             
             # Get line_ref and look up route data
             line_ref = in_feature[line_ref_field]
@@ -403,27 +521,29 @@ class EnrichWithRoutes(QgsProcessingAlgorithm):
                 except (ValueError, TypeError):
                     pass
             
-            # Add route fields (only those that were actually added as new fields)
-            for field_name in new_route_fields:
-                if route_data:
-                    # Special handling for route_desc (calculated field)
-                    if field_name == 'route_desc':
-                        route_mkt = route_data.get('route_mkt', '')
-                        route_direction = route_data.get('route_direction', '')
-                        route_alternative = route_data.get('route_alternative', '')
-                        value = f"{route_mkt}-{route_direction}-{route_alternative}"
-                    else:
-                        # Map field name to API key if needed
-                        api_key = self.GTFS_FIELD_MAP.get(field_name, field_name)
-                        value = route_data.get(api_key)
-                    attributes.append(value if value is not None else NULL)
-                else:
-                    attributes.append(NULL)
+            # Fill route fields (only those that were actually added as new fields)
+            if route_data:
+                for index, api_key in route_plan:
+                    value = route_data.get(api_key)
+                    if value is not None:
+                        attributes[index] = value
             
-            out_feature.setAttributes(attributes)
-            sink.addFeature(out_feature, QgsFeatureSink.FastInsert)
+            # Turn the fetched input feature into the output feature; the
+            # iterator yields a new object each time, so no copy is needed
+            in_feature.setFields(output_fields, False)
+            in_feature.setAttributes(attributes)
+            batch.append(in_feature)
+            if len(batch) >= self.SINK_BATCH_SIZE:
+                sink.addFeatures(batch, QgsFeatureSink.FastInsert)
+                batch.clear()
             
-            # Update progress (60-100%)
+            # Update progress (60-100%), only when the value changes
             if total > 0:
                 progress = 60 + int((i + 1) / total * 40)
-                feedback.setProgress(progress)
+                if progress != last_progress:
+                    feedback.setProgress(progress)
+                    last_progress = progress
+        
+        # Flush the remaining features
+        if batch:
+            sink.addFeatures(batch, QgsFeatureSink.FastInsert)
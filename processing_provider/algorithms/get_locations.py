@@ -5,6 +5,10 @@ This module provides a QGIS processing algorithm for fetching vehicle location
 data from the Open Bus Stride API using time-based queries.
 """
 
+import ast
+import itertools
+from datetime import datetime, timedelta, timezone
+
 from qgis.PyQt.QtCore import QCoreApplication, QDateTime, Qt, QVariant
 from qgis.core import (
     QgsProcessingAlgorithm,
@@ -23,7 +27,8 @@ from qgis.core import (
     QgsWkbTypes,
     QgsCoordinateReferenceSystem,
     QgsCoordinateTransform,
-    NULL
+    QgsProcessingUtils,
+    QgsVectorDataProvider
 )
 
 from ...requests.stride_api_client import StrideAPIClient
@@ -43,6 +48,12 @@ class GetLocations(QgsProcessingAlgorithm):
     INPUT_DURATION = 'INPUT_DURATION'
     OUTPUT = 'OUTPUT'
 
+    # Number of features written to the sink per addFeatures call
+    SINK_BATCH_SIZE = 10000
+
+    # Number of features between cancellation and progress checks
+    FEEDBACK_INTERVAL = 1024
+
     # Field mapping from API response to output layer
     FIELD_DEFINITIONS = [
         ('id', QVariant.LongLong),
@@ -80,6 +91,12 @@ class GetLocations(QgsProcessingAlgorithm):
         'siri_ride__vehicle_ref': 'vehicle_ref',
     }
 
+    # Output field name -> API key; reversed so the first KEY_MAP entry wins
+    # when several API keys map to the same field
+    _REVERSE_KEY_MAP = {v: k for k, v in reversed(KEY_MAP.items())}
+
+    _EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
     def tr(self, string):
         """Translate strings for internationalization."""
         return QCoreApplication.translate('Processing', string)
@@ -118,6 +135,10 @@ class GetLocations(QgsProcessingAlgorithm):
             - Start Time: Beginning of the time window (UTC)
             - Duration: Length of time window in minutes
             - Additional Parameters: Optional query parameters as Python dictionary
+            
+            A 'limit' parameter sets the total number of records to fetch;
+            large limits are downloaded in several pages, ordered by 'id'
+            unless an 'order_by' parameter is given.
             """
         )
 
@@ -192,8 +213,10 @@ class GetLocations(QgsProcessingAlgorithm):
         params = self._parse_parameters(params_str)
 
         # Add spatial filter if extent provided
+        extent_wgs84 = None
         if not extent.isNull():
-            self._add_spatial_filter(params, extent, extent_crs, context)
+            extent_wgs84 = self._add_spatial_filter(
+                params, extent, extent_crs, context)
 
         # Add temporal filter if start time provided
         if start_time.isValid():
@@ -204,22 +227,62 @@ class GetLocations(QgsProcessingAlgorithm):
         feedback.setProgress(0)
 
         api_client = StrideAPIClient(feedback)
-        data = api_client.fetch_data(api_path, params)
+        pages = api_client.iter_pages(api_path, params)
+        first_page = next(pages, None)
 
-        if not data:
+        if not first_page:
             feedback.pushInfo(self.tr("No data received from API."))
             return {self.OUTPUT: None}
 
         feedback.setProgress(50)
 
-        # Phase 2: Process features
+        # Phase 2: Process features, fetching remaining pages as needed
         feedback.pushInfo(self.tr('Phase 2/2: Processing features...'))
         sink = self._create_output_sink(parameters, context)
 
-        self._process_features(data, sink, context, feedback)
+        # Without a positive limit the API answered with a single page
+        expected_total = max(int(params.get('limit', 0)), len(first_page))
+        self._process_features(
+            itertools.chain([first_page], pages), expected_total,
+            extent_wgs84, sink, context, feedback
+        )
+
+        # After a cancel, stop the pages still downloading right away
+        pages.close()
+
+        # Release the sink so file outputs are closed before indexing
+        dest_id = sink[1]
+        del sink
+        self._create_spatial_index(dest_id, context, feedback)
 
         feedback.setProgress(100)
-        return {self.OUTPUT: sink[1]}
+        return {self.OUTPUT: dest_id}
+
+    def _create_spatial_index(self, dest_id, context, feedback):
+        """
+        Build the spatial index of a file output once all features are written.
+
+        Runs in the algorithm's thread, so large outputs do not block the
+        GUI the way postProcessAlgorithm (run on the main thread) would.
+        Temporary memory outputs are left without an index, as before.
+
+        Args:
+            dest_id (str): Output layer id or source returned with the sink
+            context: Processing context
+            feedback: Processing feedback object
+        """
+        if feedback.isCanceled():
+            return
+
+        layer = QgsProcessingUtils.mapLayerFromString(dest_id, context)
+        if layer is None:
+            return
+
+        provider = layer.dataProvider()
+        if (provider.name() == 'ogr' and provider.capabilities()
+                & QgsVectorDataProvider.CreateSpatialIndex):
+            feedback.pushInfo(self.tr('Building spatial index...'))
+            provider.createSpatialIndex()
 
     def _parse_parameters(self, params_str):
         """
@@ -237,10 +300,10 @@ class GetLocations(QgsProcessingAlgorithm):
         params = {}
         if params_str:
             try:
-                params = eval(params_str)
+                params = ast.literal_eval(params_str)
                 if not isinstance(params, dict):
                     raise TypeError("Parameters must be a dictionary")
-            except (SyntaxError, TypeError) as e:
+            except (SyntaxError, TypeError, ValueError) as e:
                 raise QgsProcessingException(
                     self.tr(f"Invalid format for parameters: {e}")
                 )
@@ -255,6 +318,9 @@ class GetLocations(QgsProcessingAlgorithm):
             extent: QgsRectangle extent
             extent_crs: Source CRS of the extent
             context: Processing context
+
+        Returns:
+            QgsRectangle: The extent in WGS84
         """
         target_crs = QgsCoordinateReferenceSystem('EPSG:4326')
         transform = QgsCoordinateTransform(
@@ -267,6 +333,8 @@ class GetLocations(QgsProcessingAlgorithm):
         params['lat__greater_or_equal'] = extent_wgs84.yMinimum()
         params['lat__lower_or_equal'] = extent_wgs84.yMaximum()
 
+        return extent_wgs84
+
     def _add_temporal_filter(self, params, start_time, duration_minutes):
         """
         Add temporal filter to parameters.
@@ -305,30 +373,42 @@ class GetLocations(QgsProcessingAlgorithm):
         # Use Israel Grid CRS
         dest_crs = QgsCoordinateReferenceSystem('EPSG:2039')
 
-        # Create sink
-        (sink, dest_id) = self.parameterAsSink(
-            parameters, self.OUTPUT, context, fields,
-            QgsWkbTypes.Point, dest_crs
-        )
+        # Create sink; file outputs skip the spatial index while writing,
+        # it is built in one pass by _create_spatial_index. Older QGIS
+        # versions do not accept layer options and index while writing
+        try:
+            (sink, dest_id) = self.parameterAsSink(
+                parameters, self.OUTPUT, context, fields,
+                QgsWkbTypes.Point, dest_crs,
+                layerOptions=['SPATIAL_INDEX=NO']
+            )
+        except TypeError:
+            (sink, dest_id) = self.parameterAsSink(
+                parameters, self.OUTPUT, context, fields,
+                QgsWkbTypes.Point, dest_crs
+            )
 
         if sink is None:
             raise QgsProcessingException(self.tr('Invalid output specified.'))
 
         return (sink, dest_id)
 
-    def _process_features(self, data, sink_info, context, feedback):
+    def _process_features(self, pages, expected_total, extent_wgs84,
+                          sink_info, context, feedback):
         """
-        Process API data and add features to the output sink.
+        Process API data page by page and add features to the output sink.
 
         Args:
-            data (list): List of data items from API
+            pages (iterable): Lists of data items from API, one per page
+            expected_total (int): Upper bound of items, used for progress
+            extent_wgs84 (QgsRectangle): Filter extent in WGS84, or None
             sink_info (tuple): (sink, dest_id) from _create_output_sink
             context: Processing context
             feedback: Processing feedback object
         """
         sink = sink_info[0]
-        total = len(data)
-        feedback.pushInfo(self.tr(f'Processing {total} features...'))
+        feedback.pushInfo(
+            self.tr(f'Processing up to {expected_total} features...'))
 
         # Setup coordinate transformation
         source_crs = QgsCoordinateReferenceSystem('EPSG:4326')
@@ -337,66 +417,174 @@ class GetLocations(QgsProcessingAlgorithm):
             source_crs, dest_crs, context.transformContext()
         )
 
-        # Process each feature
-        for i, item in enumerate(data):
+        # Resolve output fields and API keys once for all features
+        fields = QgsFields()
+        for field_name, field_type in self.FIELD_DEFINITIONS:
+            fields.append(QgsField(field_name, field_type))
+        reverse_keys = [
+            self._REVERSE_KEY_MAP.get(field_name, field_name)
+            for field_name, _ in self.FIELD_DEFINITIONS
+        ]
+        datetime_indexes = [
+            index for index, (_, field_type)
+            in enumerate(self.FIELD_DEFINITIONS)
+            if field_type == QVariant.DateTime
+        ]
+
+        count = 0
+        last_progress = -1
+        progress_step = 50 / expected_total
+
+        # The item count is bounded by expected_total, so the batch buffer is
+        # allocated once at its final size and refilled in place
+        batch_size = min(expected_total, self.SINK_BATCH_SIZE)
+        batch = [None] * batch_size
+        filled = 0
+
+        # Bind names used per feature to locals
+        create_feature = self._create_feature
+        add_features = sink.addFeatures
+        fast_insert = QgsFeatureSink.FastInsert
+        feedback_interval = self.FEEDBACK_INTERVAL
+
+        for data in pages:
+            # Reproject all valid points of the page in a single call
+            items, points = self._project_points(
+                data, transform, extent_wgs84)
+
+            # Process each feature
+            for item, point in zip(items, points):
+                batch[filled] = create_feature(
+                    item, point, fields, reverse_keys, datetime_indexes)
+                filled += 1
+                if filled == batch_size:
+                    add_features(batch, fast_insert)
+                    filled = 0
+                count += 1
+
+                # Check for cancellation every FEEDBACK_INTERVAL features
+                if count % feedback_interval == 0:
+                    if feedback.isCanceled():
+                        break
+                    progress = 50 + min(int(count * progress_step), 50)
+                    if progress != last_progress:
+                        feedback.setProgress(progress)
+                        last_progress = progress
+
+            # Update progress (50-100%) and stop before the next page is
+            # requested if canceled
+            progress = 50 + min(int(count * progress_step), 50)
+            if progress != last_progress:
+                feedback.setProgress(progress)
+                last_progress = progress
             if feedback.isCanceled():
                 break
 
-            feature = self._create_feature(item, transform)
-            if feature is not None:
-                sink.addFeature(feature, QgsFeatureSink.FastInsert)
+        # Flush the remaining features
+        if filled:
+            add_features(batch[:filled], fast_insert)
 
-            # Update progress (50-100%)
-            progress = 50 + int((i + 1) / total * 50)
-            feedback.setProgress(progress)
+        feedback.pushInfo(self.tr(f'Processed {count} features'))
 
-    def _create_feature(self, item, transform):
+    def _project_points(self, data, transform, extent_wgs84=None):
         """
-        Create a feature from an API data item.
+        Reproject the lon/lat of all API data items in one batch.
+
+        Items with missing or invalid coordinates are skipped, as are items
+        outside extent_wgs84 when it is given.
 
         Args:
-            item (dict): Single data item from API response
+            data (list): List of data items from API
             transform: QgsCoordinateTransform for geometry transformation
+            extent_wgs84 (QgsRectangle): Filter extent in WGS84 (optional)
 
         Returns:
-            QgsFeature or None: Created feature, or None if invalid
+            tuple: (list of valid items, list of projected QgsPointXY)
         """
-        # Create fields
-        fields = QgsFields()
-        for field_name, field_type in self.FIELD_DEFINITIONS:
-            fields.append(QgsField(field_name, field_type))
+        if extent_wgs84 is not None:
+            x_min = extent_wgs84.xMinimum()
+            x_max = extent_wgs84.xMaximum()
+            y_min = extent_wgs84.yMinimum()
+            y_max = extent_wgs84.yMaximum()
+
+        items = []
+        points = []
+        for item in data:
+            if item.get('lon') is None or item.get('lat') is None:
+                continue
+            try:
+                lon = float(item['lon'])
+                lat = float(item['lat'])
+            except (ValueError, TypeError):
+                continue
+
+            # Drop fringe rows the API returned outside the requested extent
+            if extent_wgs84 is not None and not (
+                    x_min <= lon <= x_max and y_min <= lat <= y_max):
+                continue
+
+            points.append(QgsPointXY(lon, lat))
+            items.append(item)
+
+        if not points:
+            return items, points
+
+        # Transform a single multipoint geometry instead of each point
+        multipoint = QgsGeometry.fromMultiPointXY(points)
+        multipoint.transform(transform)
+        return items, multipoint.asMultiPoint()
+
+    def _create_feature(self, item, point, fields, reverse_keys,
+                        datetime_indexes):
+        """
+        Create a feature from an API data item.
+
+        Args:
+            item (dict): Single data item from API response
+            point (QgsPointXY): Item location in the output CRS
+            fields (QgsFields): Output layer fields
+            reverse_keys (list): API response key for each output field
+            datetime_indexes (list): Indexes of the DateTime output fields
 
+        Returns:
+            QgsFeature: Created feature
+        """
         feature = QgsFeature(fields)
 
         # Set geometry
-        if item.get('lon') is not None and item.get('lat') is not None:
-            try:
-                point_wgs84 = QgsPointXY(
-                    float(item['lon']), float(item['lat']))
-                geom = QgsGeometry.fromPointXY(
-                    transform.transform(point_wgs84))
-                feature.setGeometry(geom)
-            except (ValueError, TypeError):
-                return None
-        else:
-            return None
-
-        # Set attributes
-        attributes = []
-        for field in fields:
-            original_key = next(
-                (k for k, v in self.KEY_MAP.items() if v == field.name()),
-                field.name()
-            )
-            val = item.get(original_key)
+        feature.setGeometry(QgsGeometry.fromPointXY(point))
 
-            if val is None:
-                attributes.append(NULL)
-            elif field.type() == QVariant.DateTime:
-                dt = QDateTime.fromString(val, Qt.DateFormat.ISODate)
-                attributes.append(dt)
-            else:
-                attributes.append(val)
+        # Set attributes, looking all values up in a single C-level map.
+        # setAttributes already stores None as a NULL value
+        attributes = list(map(item.get, reverse_keys))
+        for index in datetime_indexes:
+            if attributes[index] is not None:
+                attributes[index] = self._parse_datetime(attributes[index])
 
         feature.setAttributes(attributes)
         return feature
+
+    def _parse_datetime(self, value):
+        """
+        Parse an ISO 8601 timestamp from the API into a QDateTime.
+
+        Timezone-aware values are parsed with datetime.fromisoformat, which
+        is much faster than Qt's parser; anything else falls back to
+        QDateTime.fromString.
+
+        Args:
+            value (str): ISO 8601 timestamp
+
+        Returns:
+            QDateTime: Parsed timestamp
+        """
+        try:
+            dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except (ValueError, AttributeError):
+            dt = None
+
+        if dt is None or dt.tzinfo is None:
+            return QDateTime.fromString(value, Qt.DateFormat.ISODate)
+
+        msecs = (dt - self._EPOCH) // timedelta(milliseconds=1)
+        return QDateTime.fromMSecsSinceEpoch(msecs, Qt.TimeSpec.UTC)
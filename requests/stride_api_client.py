@@ -5,12 +5,43 @@ This module provides functionality to interact with the Open Bus Stride API.
 It handles network requests, response parsing, and error handling.
 """
 
-from qgis.PyQt.QtCore import QUrl, QEventLoop
+from qgis.PyQt.QtCore import QUrl, QUrlQuery, QEventLoop
 from qgis.PyQt.QtNetwork import QNetworkRequest, QNetworkReply
 from qgis.core import QgsNetworkAccessManager, QgsProcessingException
 
-import urllib.parse
 import json
+import time
+from datetime import datetime, timedelta, timezone
+
+# Prefer orjson when installed: it parses bytes directly without decoding
+# to a str first, and is several times faster on large responses
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    def _loads(body):
+        return json.loads(str(body, 'utf-8'))
+
+
+def _buffer(byte_array):
+    """
+    View a QByteArray as a bytes-like object, without copying when possible.
+    
+    Args:
+        byte_array (QByteArray): Data read from a network reply
+        
+    Returns:
+        memoryview/bytes: Buffer over the same data
+    """
+    try:
+        return memoryview(byte_array)
+    except TypeError:
+        return bytes(byte_array)
+
+
+def _percent_encode(value):
+    """Percent-encode a query key or value, keeping ':' readable."""
+    return bytes(QUrl.toPercentEncoding(str(value), b':')).decode('ascii')
 
 
 class StrideAPIClient:
@@ -22,6 +53,31 @@ class StrideAPIClient:
     """
     
     BASE_URL = 'https://open-bus-stride-api.hasadna.org.il'
+    PAGE_SIZE = 1000
+    MAX_PARALLEL_PAGES = 4
+    
+    # Transient server errors worth retrying
+    RETRY_STATUS_CODES = (502, 503, 504)
+    MAX_RETRIES = 3
+    RETRY_BACKOFF = 0.3
+    
+    # Replies aborted by the QGIS network timeout (Settings > Options >
+    # Network) are retried once only: a slow query is likely to time out
+    # again, and each attempt re-runs it on the server
+    RETRY_NETWORK_ERRORS = (
+        QNetworkReply.NetworkError.OperationCanceledError,
+        QNetworkReply.NetworkError.TimeoutError,
+    )
+    MAX_TIMEOUT_RETRIES = 1
+    
+    # Vehicle locations recorded this long ago are no longer updated, so
+    # cached copies of such windows are served without revalidation
+    SETTLED_AFTER = timedelta(days=1)
+    
+    # Bodies with no items (e.g. the page after the last one), answered
+    # without running the JSON parser
+    EMPTY_BODIES = (b'[]', b'null', b'')
+    EMPTY_BODY_MAX_SIZE = 16
     
     def __init__(self, feedback=None):
         """
@@ -32,6 +88,7 @@ class StrideAPIClient:
         """
         self.feedback = feedback
         self.manager = QgsNetworkAccessManager.instance()
+        self._base_url = QUrl(self.BASE_URL)
     
     def fetch_data(self, api_path, params=None):
         """
@@ -50,10 +107,166 @@ class StrideAPIClient:
         if params is None:
             params = {}
         
-        # Build the request URL
-        url = self._build_url(api_path, params)
+        return self.fetch_many([(api_path, params)])[0]
+    
+    def fetch_many(self, requests):
+        """
+        Fetch several API queries concurrently.
+        
+        All requests are issued at once and their replies are collected by a
+        single event loop, so the total wait is about the slowest request
+        rather than the sum of all of them.
+        
+        Args:
+            requests (list): (api_path, params) tuple for each request
+            
+        Returns:
+            list: Parsed list of items for each request, in the same order
+            
+        Raises:
+            QgsProcessingException: If a request fails or response is invalid
+        """
+        return self.collect(self.prefetch(requests))
+    
+    def prefetch(self, requests):
+        """
+        Issue API requests without waiting for their replies.
+        
+        The downloads proceed in the background, e.g. while the caller is
+        still processing an earlier page, until collect() is called.
+        
+        Args:
+            requests (list): (api_path, params) tuple for each request
+            
+        Returns:
+            tuple: Pending requests handle to pass to collect()
+        """
+        urls = [self._build_url(api_path, params) for api_path, params in requests]
+        for url in urls:
+            self._log_request(url)
         
-        # Log the request
+        return (urls, self._issue(urls))
+    
+    def collect(self, pending):
+        """
+        Wait for prefetched requests and parse their responses.
+        
+        Args:
+            pending (tuple): Handle returned by prefetch()
+            
+        Returns:
+            list: Parsed list of items for each request, in the same order
+            
+        Raises:
+            QgsProcessingException: If a request fails or response is invalid
+        """
+        results = self._collect(*pending)
+        return [self._validate_items(data) for data in results]
+    
+    def iter_pages(self, api_path, params=None):
+        """
+        Fetch data from the Stride API one page at a time.
+        
+        When params contains a positive 'limit', it caps the total number of
+        items across all pages and the pages are requested with limit/offset
+        of at most PAGE_SIZE items each. After the first page, up to
+        MAX_PARALLEL_PAGES pages are requested concurrently. Pages are
+        ordered by 'id asc' unless params sets 'order_by', so that no row
+        moves between pages. Without a 'limit', or with a non-positive one,
+        a single request is made with params unchanged.
+        
+        Args:
+            api_path (str): API endpoint path (e.g., '/siri_vehicle_locations/list')
+            params (dict): Query parameters for the request (optional)
+            
+        Yields:
+            list: Parsed JSON items of each non-empty page
+            
+        Raises:
+            QgsProcessingException: If a request fails or response is invalid
+        """
+        if params is None:
+            params = {}
+        
+        try:
+            remaining = int(params.get('limit', 0))
+            offset = int(params.get('offset', 0))
+        except (TypeError, ValueError) as e:
+            raise QgsProcessingException(
+                f"Invalid 'limit' or 'offset' parameter: {e}"
+            )
+        
+        if remaining <= 0:
+            data = self.fetch_data(api_path, params)
+            if data:
+                yield data
+            return
+        
+        # Offset paging needs a stable order across concurrent requests
+        if 'order_by' not in params:
+            params = dict(params, order_by='id asc')
+        
+        def next_window(count):
+            nonlocal remaining, offset
+            page_params_list = []
+            while remaining > 0 and len(page_params_list) < count:
+                page_limit = min(self.PAGE_SIZE, remaining)
+                page_params_list.append(
+                    dict(params, limit=page_limit, offset=offset)
+                )
+                remaining -= page_limit
+                offset += page_limit
+            return page_params_list
+        
+        def prefetch_window(page_params_list):
+            if not page_params_list:
+                return None
+            return self.prefetch(
+                [(api_path, page_params) for page_params in page_params_list]
+            )
+        
+        # Fetch the first page alone so small queries cost one request
+        page_params_list = next_window(1)
+        pending = prefetch_window(page_params_list)
+        try:
+            while pending is not None:
+                # collect() deletes the replies, so they must not be aborted
+                # afterwards even if it raises
+                window, pending = pending, None
+                pages = self.collect(window)
+                
+                # A short page means there is nothing left to fetch
+                all_full = all(
+                    len(data) == page_params['limit']
+                    for page_params, data in zip(page_params_list, pages)
+                )
+                
+                # Request the next window before handing these pages to the
+                # caller, so downloading overlaps their processing
+                next_params_list = (
+                    next_window(self.MAX_PARALLEL_PAGES) if all_full else []
+                )
+                pending = prefetch_window(next_params_list)
+                
+                for page_params, data in zip(page_params_list, pages):
+                    if data:
+                        yield data
+                    if len(data) < page_params['limit']:
+                        return
+                
+                page_params_list = next_params_list
+        finally:
+            # The caller stopped early (e.g. canceled): drop in-flight requests
+            if pending is not None:
+                self._abort(pending)
+    
+    def _log_request(self, url):
+        """
+        Report a request URL to the feedback as a clickable link.
+        
+        Args:
+            url (QUrl): Request URL
+        """
         if self.feedback:
             url_str = url.toString()
             message = f"Requesting data from: <a href=\"{url_str}\">{url_str}</a>"
@@ -61,11 +274,17 @@ class StrideAPIClient:
                 message,
                 message
             )
+    
+    def _validate_items(self, data):
+        """
+        Ensure a parsed response is a list of items.
         
-        # Execute the request
-        data = self._execute_request(url)
-        
-        # Validate response
+        Args:
+            data: Parsed JSON response
+            
+        Returns:
+            list: The response, or an empty list if it was not a list
+        """
         if not isinstance(data, list):
             if self.feedback:
                 self.feedback.pushWarning("Response did not contain a list of items.")
@@ -84,27 +303,208 @@ class StrideAPIClient:
         Returns:
             QUrl: Complete URL with encoded parameters
         """
-        query_string = urllib.parse.urlencode(params, safe=':')
-        url = QUrl(f"{self.BASE_URL}{api_path}")
-        url.setQuery(query_string)
+        # QUrlQuery leaves '+' as is, which the API would read as a space
+        # (e.g. in '+03:00' offsets), so items are percent-encoded up front
+        query = QUrlQuery()
+        for key, value in params.items():
+            query.addQueryItem(
+                _percent_encode(key),
+                _percent_encode(value)
+            )
+        
+        url = QUrl(self._base_url)
+        url.setPath(api_path)
+        url.setQuery(query)
         return url
     
-    def _execute_request(self, url):
+    def _build_request(self, url):
         """
-        Execute the network request and parse the response.
+        Build a network request for a URL.
+        
+        HTTP/2 is allowed so that concurrent requests to the API host can be
+        multiplexed over a single connection; when the server only speaks
+        HTTP/1.1, pipelining lets them share the kept-alive connections.
+        
+        The network manager requests compressed responses and inflates them
+        transparently. Large, repetitive JSON bodies can exceed the
+        compression ratio Qt 6 treats as a decompression bomb, so that safety
+        check is disabled.
+        
+        Queries for a recorded_at window that ended more than SETTLED_AFTER
+        ago are served from the QGIS network cache whenever it holds a copy,
+        even a stale one, without a network round trip. All other queries,
+        such as live windows and GTFS routes, use the default cache control.
         
         Args:
             url (QUrl): Request URL
             
         Returns:
-            dict/list: Parsed JSON response
+            QNetworkRequest: Configured request
+        """
+        request = QNetworkRequest(url)
+        request.setAttribute(QNetworkRequest.Attribute.Http2AllowedAttribute, True)
+        request.setAttribute(
+            QNetworkRequest.Attribute.HttpPipeliningAllowedAttribute, True
+        )
+        if hasattr(request, 'setDecompressedSafetyCheckThreshold'):  # Qt >= 6.2
+            request.setDecompressedSafetyCheckThreshold(-1)
+        if self._is_settled(url):
+            request.setAttribute(
+                QNetworkRequest.Attribute.CacheLoadControlAttribute,
+                QNetworkRequest.CacheLoadControl.PreferCache
+            )
+        return request
+    
+    def _is_settled(self, url):
+        """
+        Tell whether a URL queries a recorded_at window that ended long ago.
+        
+        Args:
+            url (QUrl): Request URL
+            
+        Returns:
+            bool: True if recorded_at_time_to is older than SETTLED_AFTER
+        """
+        value = QUrlQuery(url).queryItemValue(
+            'recorded_at_time_to', QUrl.ComponentFormattingOption.FullyDecoded
+        )
+        if not value:
+            return False
+        
+        try:
+            end_time = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return False
+        if end_time.tzinfo is None:
+            end_time = end_time.replace(tzinfo=timezone.utc)
+        
+        return datetime.now(timezone.utc) - end_time > self.SETTLED_AFTER
+    
+    def _issue(self, urls):
+        """
+        Issue GET requests for all URLs without waiting for the replies.
+        
+        All requests are issued up front, so the shared network manager can
+        run them in parallel over its pooled connections.
+        
+        Args:
+            urls (list): Request URLs (QUrl)
+            
+        Returns:
+            list: QNetworkReply for each URL, in the same order
+        """
+        requests = [self._build_request(url) for url in urls]
+        return [self.manager.get(request) for request in requests]
+    
+    def _wait(self, replies):
+        """
+        Wait until every reply has finished, using a single event loop.
+        
+        Args:
+            replies (list): QNetworkReply objects to wait for
+        """
+        loop = QEventLoop()
+        pending = sum(1 for reply in replies if not reply.isFinished())
+        
+        def on_finished():
+            nonlocal pending
+            pending -= 1
+            if pending == 0:
+                loop.quit()
+        
+        for reply in replies:
+            if not reply.isFinished():
+                reply.finished.connect(on_finished)
+        
+        # When run on the main thread, keep user input from re-entering the
+        # plugin while the requests are waited for
+        if pending:
+            loop.exec(QEventLoop.ProcessEventsFlag.ExcludeUserInputEvents)
+    
+    def _collect(self, urls, replies):
+        """
+        Wait for issued requests and parse their responses.
+        
+        Requests answered with a transient HTTP status (RETRY_STATUS_CODES)
+        are retried up to MAX_RETRIES times with exponential backoff, and
+        timed out ones (RETRY_NETWORK_ERRORS) up to MAX_TIMEOUT_RETRIES
+        times.
+        
+        Args:
+            urls (list): Request URLs (QUrl)
+            replies (list): QNetworkReply issued for each URL
+            
+        Returns:
+            list: Parsed JSON response for each URL, in the same order
             
         Raises:
-            QgsProcessingException: If the request fails or JSON parsing fails
+            QgsProcessingException: If a request fails or JSON parsing fails
         """
-        request = QNetworkRequest(url)
-        reply = self.manager.blockingGet(request)
+        results = [None] * len(urls)
+        todo = list(range(len(urls)))
         
+        for attempt in range(self.MAX_RETRIES + 1):
+            self._wait(replies)
+            retry = []
+            try:
+                for index, reply in zip(todo, replies):
+                    status_code = reply.attribute(
+                        QNetworkRequest.Attribute.HttpStatusCodeAttribute
+                    )
+                    if status_code in self.RETRY_STATUS_CODES:
+                        can_retry = attempt < self.MAX_RETRIES
+                    elif reply.error() in self.RETRY_NETWORK_ERRORS:
+                        can_retry = attempt < self.MAX_TIMEOUT_RETRIES
+                    else:
+                        can_retry = False
+                    if can_retry:
+                        retry.append(index)
+                        continue
+                    results[index] = self._parse_reply(reply)
+            finally:
+                for reply in replies:
+                    reply.deleteLater()
+            
+            if not retry:
+                break
+            
+            delay = self.RETRY_BACKOFF * 2 ** attempt
+            if self.feedback:
+                self.feedback.pushWarning(
+                    f"Retrying {len(retry)} request(s) in {delay:.1f}s..."
+                )
+            time.sleep(delay)
+            todo = retry
+            replies = self._issue([urls[index] for index in todo])
+        
+        return results
+    
+    def _abort(self, pending):
+        """
+        Cancel prefetched requests whose responses are no longer needed.
+        
+        Args:
+            pending (tuple): Handle returned by prefetch()
+        """
+        _, replies = pending
+        for reply in replies:
+            if not reply.isFinished():
+                reply.abort()
+            reply.deleteLater()
+    
+    def _parse_reply(self, reply):
+        """
+        Check a finished network reply and parse its JSON body.
+        
+        Args:
+            reply (QNetworkReply): Finished reply
+            
+        Returns:
+            dict/list: Parsed JSON response
+            
+        Raises:
+            QgsProcessingException: If the request failed or JSON parsing fails
+        """
         # Check for network errors
         if reply.error() != QNetworkReply.NetworkError.NoError:
             raise QgsProcessingException(
@@ -120,8 +520,12 @@ class StrideAPIClient:
         
         # Parse JSON response
         try:
-            response_body = bytes(reply.content())
-            data = json.loads(response_body.decode('utf-8'))
+            response_body = _buffer(reply.readAll())
+            if (len(response_body) <= self.EMPTY_BODY_MAX_SIZE
+                    and bytes(response_body).strip() in self.EMPTY_BODIES):
+                return []
+            
+            data = _loads(response_body)
             return data
-        except json.JSONDecodeError as e:
+        except ValueError as e:  # JSONDecodeError and UnicodeDecodeError
             raise QgsProcessingException(f"Failed to parse JSON response: {e}")